@@ -27,12 +27,19 @@ Mailing Set can be added to a Twisted application using the following code:
 from __future__ import absolute_import
 from builtins import str
 from builtins import object
-import email
-from email import parser
+import collections
+import email.generator
+import email.header
+import email.parser
+import functools
+import io
+import time
 import netaddr
 
 from zope.interface import implementer
 
+from twisted.internet import defer
+from twisted.logger import Logger, LogLevel
 from twisted.mail import smtp
 from twisted.python import log
 
@@ -45,6 +52,93 @@ from . import parser
 __all__ = ['SetSMTPFactory']
 
 
+# Server configuration values that are looked up on every connection or message,
+# resolved once from the ConfigParser object when the factory is created.
+#   domain: The domain part of addresses that may be mailing lists.
+#   domain_bytes: The same domain lowercased and encoded as bytes, for comparing
+#       against addresses reported by Twisted.
+#   accept_from: A netaddr.IPSet of client addresses to accept mail from, or
+#       None if mail is accepted from any address.
+#   outgoing_server: Host of the SMTP server through which to send mail.
+#   outgoing_port: Port of the SMTP server through which to send mail.
+#   envelope_sender: Envelope sender of outgoing messages.
+#   outgoing_batch_size: Maximum number of recipients per outgoing connection.
+#   outgoing_max_connections: Maximum number of simultaneous connections to the
+#       outgoing server.
+#   archive_addr: Address to include on all outgoing messages, or None.
+#   list_id_fmt: Format of the List-Id header, taking the list address.
+#   list_post_fmt: Format of the List-Post header, taking the list address.
+Settings = collections.namedtuple('Settings', [
+    'domain', 'domain_bytes', 'accept_from', 'outgoing_server',
+    'outgoing_port', 'envelope_sender', 'outgoing_batch_size',
+    'outgoing_max_connections', 'archive_addr', 'list_id_fmt',
+    'list_post_fmt'])
+
+
+class ParseCache(object):
+    """Memoizes the parsing of destination addresses as set expressions.
+
+    List definitions do not change while the server runs, so the outcome of
+    parsing an address never changes either. Accepted addresses and rejected
+    addresses are remembered in separate bounded caches, so that a flood of
+    mistyped or random addresses cannot evict the frequently used valid ones.
+    """
+
+    def __init__(self, parse, maxsize=1024, rejected_maxsize=256):
+        """
+        Args:
+            parse: A function taking the local part of an email address and
+                returning a pair (tag,addrs) of subject tag and set of recipient
+                addresses, or raising SyntaxError if the address is rejected.
+            maxsize: The number of accepted addresses to remember.
+            rejected_maxsize: The number of rejected addresses to remember.
+        """
+        self._parse = parse
+        self._accepted = collections.OrderedDict()
+        self._rejected = collections.OrderedDict()
+        self._maxsize = maxsize
+        self._rejected_maxsize = rejected_maxsize
+
+    def __call__(self, address):
+        """Parses an address, reusing the outcome of any earlier parse.
+
+        Args:
+            address: The local part of the email address to parse.
+
+        Returns:
+            A pair (tag,addrs) of subject tag and recipient addresses. The
+            addresses are a frozenset which may be shared with other callers.
+
+        Raises:
+            SyntaxError: If the address is rejected by the parse function.
+        """
+        if address in self._accepted:
+            self._accepted.move_to_end(address)
+            return self._accepted[address]
+        if address in self._rejected:
+            self._rejected.move_to_end(address)
+            raise SyntaxError(self._rejected[address])
+
+        try:
+            subject_tag, recipient_set = self._parse(address)
+        except SyntaxError as error:
+            self._remember(self._rejected, self._rejected_maxsize, address,
+                    str(error))
+            raise
+        result = (subject_tag, frozenset(recipient_set))
+        self._remember(self._accepted, self._maxsize, address, result)
+        return result
+
+    @staticmethod
+    def _remember(cache, maxsize, address, value):
+        """Adds an entry to a cache, evicting the least recently used one if
+        the cache is full.
+        """
+        cache[address] = value
+        if len(cache) > maxsize:
+            cache.popitem(last=False)
+
+
 class SetSMTPFactory(smtp.SMTPFactory):
 
     def __init__(self, config, sendmail, *a, **kw):
@@ -60,11 +154,65 @@ class SetSMTPFactory(smtp.SMTPFactory):
         smtp.SMTPFactory.__init__(self, *a, **kw)
 
         self.config = config
-        self.sendmail = sendmail
 
         # Cache list definitions and use them to parse destination addresses
         resolver = MailingSetState(self.config)
-        self.parse = lambda address: parser.parse(resolver, address)
+        self.parse = ParseCache(
+                lambda address: parser.parse(resolver, address))
+
+        self.settings = self._read_settings(config)
+
+        # Limit how many sends are in flight at once across all messages, since
+        # each one opens its own connection to the outgoing server
+        limit = defer.DeferredSemaphore(self.settings.outgoing_max_connections)
+        self.sendmail = functools.partial(limit.run, sendmail)
+
+    @staticmethod
+    def _read_settings(config):
+        """Resolves the configuration needed while serving connections.
+
+        Args:
+            config: ConfigParser object holding configuration for the Mailing
+                Set SMTP server.
+
+        Returns:
+            A Settings tuple.
+
+        Raises:
+            RuntimeError: If the outgoing batch size or connection limit is less
+                than 1.
+        """
+        batch_size = config.getint('outgoing', 'batch_size', fallback=50)
+        if batch_size < 1:
+            msg = 'Outgoing batch_size must be at least 1, not %d' % batch_size
+            raise RuntimeError(msg)
+        max_connections = config.getint('outgoing', 'max_connections',
+                fallback=10)
+        if max_connections < 1:
+            msg = ('Outgoing max_connections must be at least 1, not %d' %
+                    max_connections)
+            raise RuntimeError(msg)
+
+        domain = config.get('incoming', 'domain')
+        good = config.get('incoming', 'accept_from', fallback='0.0.0.0/0,::/0')
+        accept_from = netaddr.IPSet(
+                netaddr.IPNetwork(cidr.strip()) for cidr in good.split(','))
+        if accept_from.issuperset(netaddr.IPSet(['0.0.0.0/0', '::/0'])):
+            # Accepting from everywhere, so skip checking client addresses
+            accept_from = None
+        return Settings(
+                domain=domain,
+                domain_bytes=domain.encode().lower(),
+                accept_from=accept_from,
+                outgoing_server=config.get('outgoing', 'server'),
+                outgoing_port=config.getint('outgoing', 'port'),
+                envelope_sender=config.get('outgoing', 'envelope_sender'),
+                outgoing_batch_size=batch_size,
+                outgoing_max_connections=max_connections,
+                archive_addr=config.get('outgoing', 'archive_addr',
+                    fallback=None),
+                list_id_fmt='<%%s.mailingset.%s>' % (domain,),
+                list_post_fmt='<mailto:%%s@%s>' % (domain,))
 
     def buildProtocol(self, addr):
         """Builds the protocol governing the connection to the given address.
@@ -80,7 +228,7 @@ class SetSMTPFactory(smtp.SMTPFactory):
             The protocol, an implementation of IProtocol.
         """
         protocol = smtp.ESMTP()
-        protocol.delivery = SetMessageDelivery(protocol, self.config,
+        protocol.delivery = SetMessageDelivery(protocol, self.settings,
                 self.parse, self.sendmail)
         return protocol
 
@@ -88,23 +236,30 @@ class SetSMTPFactory(smtp.SMTPFactory):
 @implementer(smtp.IMessageDelivery)
 class SetMessageDelivery(object):
 
-    def __init__(self, protocol, config, parse, sendmail):
+    def __init__(self, protocol, settings, parse, sendmail):
         """
         Args:
             protocol: The protocol governing interaction with client
                 connections.
-            config: ConfigParser object holding configuration for the Mailing
-                Set SMTP server.
+            settings: Settings tuple holding configuration for the Mailing Set
+                SMTP server.
             parse: A function taking an email address and returning a pair of
-                subject tag and recipient address set.
+                subject tag and recipient address set. The set is a frozenset
+                which may be shared with other callers.
             sendmail: A function with the same signature as smtp.sendmail which
                 will be called to send outgoing messages.
         """
         self.protocol = protocol
-        self.config = config
+        self.settings = settings
         self.parse = parse
         self.sendmail = sendmail
 
+        # Encoded host name of the server, filled in on first use
+        self.server_hostname = None
+
+        # The most recent (second,date) pair computed by rfc822date
+        self.last_date = (None, None)
+
     def receivedHeader(self, helo, origin, recipients):
         """Generates the Received header for a message.
 
@@ -119,11 +274,27 @@ class SetMessageDelivery(object):
             The full "Received" header string.
         """
         client_hostname, _ = helo
-        server_hostname = self.protocol.transport.getHost().host
+        if self.server_hostname is None:
+            host = self.protocol.transport.getHost().host
+            self.server_hostname = host.encode()
         header_value = b'from %s by %s with ESMTP ; %s' % (
-            client_hostname, server_hostname.encode(), smtp.rfc822date())
+            client_hostname, self.server_hostname, self.rfc822date())
         return 'Received: %s' % (email.header.Header(header_value),)
 
+    def rfc822date(self):
+        """Formats the current time as an RFC 2822 date.
+
+        The result has one-second granularity, so it is only recomputed when the
+        second changes.
+
+        Returns:
+            The date as bytes, like smtp.rfc822date().
+        """
+        now = int(time.time())
+        if self.last_date[0] != now:
+            self.last_date = (now, smtp.rfc822date(time.localtime(now)))
+        return self.last_date[1]
+
     def validateFrom(self, helo, origin):
         """Validate the address from which the message originates.
 
@@ -140,18 +311,21 @@ class SetMessageDelivery(object):
             SMTPBadSender: If origin is not one of the accept_from addresses set
                 in the server config.
         """
-        good = self.config.get('incoming', 'accept_from', fallback='0.0.0.0/0')
-        for cidr in good.split(','):
-            client_ip = helo[1].decode() if isinstance(helo[1], bytes) else helo[1] # twisted uses bytes for addresses, but netaddr automatically uses strings when it detects python3, so we should convert to string here. ~@exr0n jan024
-
-            if client_ip in netaddr.IPNetwork(cidr):
-                # Accept messages from this address
-                log.msg('Receiving from %s %s' % (helo, origin))
-                return origin
-
-        # Do not accept messages from this address
-        log.msg('Rejecting from %s %s' % (helo, origin))
-        raise smtp.SMTPBadSender(helo[1])
+        accept_from = self.settings.accept_from
+        if accept_from is not None:
+            # twisted uses bytes for addresses, but netaddr automatically uses
+            # strings when it detects python3, so we should convert to string
+            # here. ~@exr0n jan024
+            client_ip = (helo[1].decode() if isinstance(helo[1], bytes)
+                    else helo[1])
+            if netaddr.IPAddress(client_ip) not in accept_from:
+                # Do not accept messages from this address
+                log.msg('Rejecting from %s %s' % (helo, origin))
+                raise smtp.SMTPBadSender(helo[1])
+
+        # Accept messages from this address
+        log.msg('Receiving from %s %s' % (helo, origin))
+        return origin
 
     def validateTo(self, user):
         """Validate the address for which the message is destined.
@@ -172,9 +346,9 @@ class SetMessageDelivery(object):
                 as a set expression. This results in a bounce back to the
                 sender.
         """
-        # Check for domain matching server's domain
+        # Check for domain matching server's domain, which is case-insensitive
         domain = user.dest.domain
-        if domain != self.config.get('incoming', 'domain').encode():
+        if domain.lower() != self.settings.domain_bytes:
             log.msg('Rejecting domain %s' % (domain,))
             reason = 'Incorrect domain: %s' % (domain,)
             raise smtp.SMTPBadRcpt(user, resp=reason)
@@ -190,32 +364,53 @@ class SetMessageDelivery(object):
 
         # Good to go, receive rest of message
         return lambda: SetMessage(
-                self.config, local, subject_tag, recipient_set, self.sendmail)
+                self.settings, local, subject_tag, recipient_set, self.sendmail)
 
 
 @implementer(smtp.IMessage)
 class SetMessage(object):
 
-    def __init__(self, config, address, subject_tag, recipient_set, sendmail):
+    # Structured logger, which only formats events if an observer renders them
+    logger = Logger()
+
+    # Subject tagging handler shared by all messages; it keeps no state between
+    # calls to process()
+    subject_prefixer = subject_prefix.SubjectPrefix()
+
+    def __init__(self, settings, address, subject_tag, recipient_set, sendmail):
         """
         Args:
-            config: ConfigParser object holding configuration for the Mailing
-                Set SMTP server.
+            settings: Settings tuple holding configuration for the Mailing Set
+                SMTP server.
             address: The original recipient address of the message.
             subject_tag: Tag that will be prepended in square brackets to the
                 message subject to indicate the target set expression.
-            recipient_set: The actual recipient addresses as a set of strings.
+            recipient_set: The actual recipient addresses as a frozenset of
+                strings. It may be shared with other messages and is never
+                modified.
             sendmail: A function with the same signature as smtp.sendmail which
                 will be called to send outgoing messages.
         """
-        self.config = config
+        # Twisted reports the address as bytes, but it is used as text in both
+        # headers and log messages
+        if isinstance(address, bytes):
+            address = address.decode()
+
+        self.settings = settings
         self.address = address
         self.subject_tag = subject_tag
         self.recipient_set = recipient_set
         self.sendmail = sendmail
 
-        # Buffer to receive rest of message
-        self.msg_parser = email.parser.FeedParser()
+        # Header values depend only on the address, so build them up front
+        self.tag = '[%s] ' % (subject_tag,)
+        self.list_id = settings.list_id_fmt % (address,)
+        self.list_post = settings.list_post_fmt % (address,)
+
+        # Buffer to receive rest of message, and the offset in it at which the
+        # body begins. Only the headers are parsed; the body is sent on as is.
+        self.msg_buffer = io.BytesIO()
+        self.body_offset = None
 
     def lineReceived(self, line):
         """Handles another line of data.
@@ -225,8 +420,14 @@ class SetMessage(object):
         Args:
             line: Line of message data without terminating newline.
         """
-        self.msg_parser.feed(line)
-        self.msg_parser.feed('\n')
+        if not isinstance(line, bytes):
+            line = line.encode()
+        self.msg_buffer.write(line)
+        self.msg_buffer.write(b'\n')
+
+        # The first empty line separates the headers from the body
+        if not line and self.body_offset is None:
+            self.body_offset = self.msg_buffer.tell()
 
     def eomReceived(self):
         """Handles the end of the message.
@@ -239,42 +440,71 @@ class SetMessage(object):
 
         Returns:
             A Deferred responsible for sending the message through the outgoing
-            server.
+            server, which fires once every batch of recipients has been sent.
         """
-        msg = self.msg_parser.close()
-        self.msg_parser = None
+        raw = self.msg_buffer.getvalue()
+        split = len(raw) if self.body_offset is None else self.body_offset
+        msg = email.parser.BytesHeaderParser().parsebytes(raw[:split])
+        self.msg_buffer = None
 
         # Prepend subject tag and set mailing list headers
         self._munge_header(msg)
 
-        # Add archival address to recipient set if there is one
-        recp = self.recipient_set
-        if self.config.has_option('outgoing', 'archive_addr'):
-            recp |= set([self.config.get('outgoing', 'archive_addr')])
+        # Add archival address to recipients if there is one. The recipient set
+        # is copied once into a flat list rather than hashed into a new set.
+        recp = list(self.recipient_set)
+        archive_addr = self.settings.archive_addr
+        if archive_addr is not None and archive_addr not in self.recipient_set:
+            recp.append(archive_addr)
 
         # Log
-        log.msg('Subject: %s' % (str(msg['Subject']),))
-        log.msg('Sending to: %s' % (', '.join(recp),))
-
-        # Get outgoing config
-        outgoing_server = self.config.get('outgoing', 'server')
-        outgoing_port = self.config.getint('outgoing', 'port')
-        envelope_sender = self.config.get('outgoing', 'envelope_sender')
-
-        # Begin sending the message!
-        send = self.sendmail(outgoing_server, envelope_sender, recp,
-                msg.as_string(), port=outgoing_port)
-        send.addCallback(log.msg, 'Success %s' % (self.address,))
-        send.addErrback(log.err, 'Failure %s' % (self.address,))
-        return send
+        self.logger.info('Subject: {subject}', subject=msg['Subject'])
+        self.logger.info('Sending to: {recipients()}',
+                recipients=functools.partial(', '.join, recp))
+
+        # Serialize the headers straight to bytes and follow them with the body
+        # exactly as received. Line endings are left as LF because the SMTP
+        # client converts them to CRLF while transmitting. Long headers are not
+        # refolded, so headers we do not touch go out as they came in.
+        output = io.BytesIO()
+        email.generator.BytesGenerator(output, mangle_from_=False,
+                maxheaderlen=0).flatten(msg)
+        output.write(memoryview(raw)[split:])
+        payload = output.getvalue()
+
+        # Begin sending the message! Recipients are split into batches which
+        # are sent over separate connections, as many at once as the factory's
+        # connection limit allows. Every batch
+        # shares the same payload bytes; smtp.sendmail wraps it in a BytesIO,
+        # which reads from the immutable bytes without copying them.
+        if not recp:
+            # Nothing to send; say so rather than silently reporting success
+            self.logger.error('No recipients for {address}',
+                    address=self.address)
+            return defer.succeed(None)
+
+        settings = self.settings
+        size = settings.outgoing_batch_size
+        sends = []
+        for start in range(0, len(recp), size):
+            send = self.sendmail(settings.outgoing_server,
+                    settings.envelope_sender, recp[start:start + size], payload,
+                    port=settings.outgoing_port)
+            send.addCallback(lambda _: self.logger.info(
+                    'Success {address}', address=self.address))
+            send.addErrback(lambda failure: self.logger.failure(
+                    'Failure {address}', failure, LogLevel.error,
+                    address=self.address))
+            sends.append(send)
+        return defer.DeferredList(sends, consumeErrors=True)
 
     def connectionLost(self):
         """Handles truncation of message by discarding anything received so far.
 
         Specified by IMessage interface.
         """
-        log.err('Connection lost %s' % (self.address,))
-        self.msg_parser = None
+        self.logger.error('Connection lost {address}', address=self.address)
+        self.msg_buffer = None
 
     def _munge_header(self, msg):
         """Prepends subject tag and sets mailing list headers.
@@ -283,9 +513,8 @@ class SetMessage(object):
             msg: The email.message.Message object whose headers to modify.
         """
         # Prepend subject tag if not already present
-        tag = '[%s] ' % (self.subject_tag,)
         try:
-            subject_prefix.SubjectPrefix().process(tag, msg)
+            self.subject_prefixer.process(self.tag, msg)
         except (UnicodeError, ValueError):
             pass
 
@@ -294,8 +523,7 @@ class SetMessage(object):
             msg['Precedence'] = 'list'
 
         # List-* headers
-        domain = self.config.get('incoming', 'domain')
         del msg['list-id']
-        msg['List-Id'] = '<%s.mailingset.%s>' % (self.address, domain)
+        msg['List-Id'] = self.list_id
         del msg['list-post']
-        msg['List-Post'] = '<mailto:%s@%s>' % (self.address, domain)
+        msg['List-Post'] = self.list_post
@@ -16,22 +16,26 @@
 
 
 import os
+import time
 
 import configparser
 import email
 import netaddr
-from io import StringIO
+from io import BytesIO
 
 from twisted.internet import address
 from twisted.internet import base
 from twisted.internet import defer
 from twisted.internet import error
+from twisted.logger import Logger, LogLevel
 from twisted.mail import smtp
 from twisted.protocols import loopback
 from twisted.test import proto_helpers
 from twisted.trial import unittest
 
-from mailingset.service import SetSMTPFactory
+from mailingset.service import ParseCache, SetMessage, SetSMTPFactory
+
+import helper
 
 
 # Print traceback at creation for delayed calls that are not cleaned up when a
@@ -77,7 +81,8 @@ class MailingSetTest(unittest.TestCase):
                 protocol. It should be callable like validate(to_addrs, msg)
                 where to_addrs is a set of recipient addresses as strings, and
                 msg is the email.message.Message object holding the headers and
-                content of the message.
+                content of the message. It is called once for each batch of
+                recipients sent to the outgoing server.
 
         Returns:
             An instance of protocol.Protocol implementing the Mailing Set SMTP
@@ -95,14 +100,14 @@ class MailingSetTest(unittest.TestCase):
                 self.assertEqual(port, self.config.getint('outgoing', 'port'))
 
                 # Parse message headers and content
-                msg_parser = email.parser.FeedParser()
+                msg_parser = email.parser.BytesFeedParser()
                 msg_parser.feed(msg)
                 parsed_msg = msg_parser.close()
                 self.assertEqual('body\n', parsed_msg.get_payload())
 
                 # Call user-supplied function for further validation
                 if validate:
-                    validate(to_addrs, parsed_msg)
+                    validate(set(to_addrs), parsed_msg)
 
             # Defer assertions so the reactor reaches a clean state even if
             # assertions fail
@@ -133,7 +138,7 @@ class MailingSetTest(unittest.TestCase):
         # object
         parsed_msg = email.parser.Parser().parsestr('body')
         parsed_msg['Subject'] = 'subject'
-        msg_file = StringIO(parsed_msg.as_string())
+        msg_file = BytesIO(parsed_msg.as_bytes())
 
         # Choose an accepted source IP address
         accept_from = self.config.get('incoming', 'accept_from')
@@ -145,6 +150,40 @@ class MailingSetTest(unittest.TestCase):
         factory = smtp.SMTPSenderFactory(from_addr, to_addr, msg_file, done)
         return factory.buildProtocol((source_ip, 0))
 
+    def _deliver(self, lines, address=b'named', recipients=('b@test.local',),
+            send_result=lambda: defer.succeed(None)):
+        """Passes a message directly through a SetMessage based on self.config.
+
+        Args:
+            lines: The lines of the incoming message as bytes, without
+                terminating newlines.
+            address: The local part of the address the message was sent to.
+            recipients: The recipient addresses the address resolved to.
+            send_result: A function returning the Deferred that each call to
+                sendmail returns.
+
+        Returns:
+            A pair (sent,events) of the list of outgoing message payloads, one
+            per call to sendmail, and the list of events logged by the
+            SetMessage.
+        """
+        sent = []
+        def sendmail(server, from_addr, to_addrs, msg, port):
+            """Records the outgoing message."""
+            sent.append(msg)
+            return send_result()
+
+        factory = SetSMTPFactory(self.config, sendmail)
+        message = SetMessage(factory.settings, address,
+                address.decode().capitalize(), frozenset(recipients),
+                factory.sendmail)
+        events = []
+        message.logger = Logger(observer=events.append)
+        for line in lines:
+            message.lineReceived(line)
+        message.eomReceived()
+        return (sent, events)
+
     def test_single_list(self):
         """Tests a message to a single list with no fancy set operations."""
         client = self._client_proto('named@test.local')
@@ -153,10 +192,214 @@ class MailingSetTest(unittest.TestCase):
             """Validates that the recipient and subject are set correctly."""
             self.assertEqual(set(['b@test.local', 'c@test.local']), to_addrs)
             self.assertEqual('[Named] subject', msg['Subject'])
+            self.assertEqual('list', msg['Precedence'])
+            self.assertEqual('<named.mailingset.test.local>', msg['List-Id'])
+            self.assertEqual('<mailto:named@test.local>', msg['List-Post'])
         server = self._server_proto(validate)
 
         return loopback.loopbackTCP(server, client)
 
+    def test_domain_case(self):
+        """Tests that the recipient domain is matched case-insensitively."""
+        client = self._client_proto('named@Test.LOCAL')
+
+        def validate(to_addrs, msg):
+            """Validates that the message was delivered to the list."""
+            self.assertEqual(set(['b@test.local', 'c@test.local']), to_addrs)
+        server = self._server_proto(validate)
+
+        return loopback.loopbackTCP(server, client)
+
+    def test_archive_addr(self):
+        """Tests that the archive address receives every message.
+
+        Adding the archive address must not leak into the cached recipient set
+        shared by later messages to the same address.
+        """
+        self.config.set('outgoing', 'archive_addr', 'archive@test.local')
+        client = self._client_proto('named@test.local')
+
+        def validate(to_addrs, msg):
+            """Validates that the archive address is among the recipients."""
+            self.assertEqual(set(['b@test.local', 'c@test.local',
+                    'archive@test.local']), to_addrs)
+        server = self._server_proto(validate)
+
+        def check_cache(_):
+            """Validates that the cached recipient set is unchanged."""
+            _, recipient_set = server.delivery.parse('named')
+            self.assertEqual(set(['b@test.local', 'c@test.local']),
+                    recipient_set)
+        done = loopback.loopbackTCP(server, client)
+        done.addCallback(check_cache)
+        return done
+
+    def test_batches(self):
+        """Tests that recipients are split into batches for sending."""
+        self.config.set('outgoing', 'batch_size', '1')
+        client = self._client_proto('named@test.local')
+
+        batches = []
+        def validate(to_addrs, msg):
+            """Records the recipients of each batch."""
+            batches.append(to_addrs)
+        server = self._server_proto(validate)
+
+        def check_batches(_):
+            """Validates that each recipient was sent a separate copy."""
+            self.assertEqual(2, len(batches))
+            self.assertEqual(set(['b@test.local', 'c@test.local']),
+                    batches[0] | batches[1])
+        done = loopback.loopbackTCP(server, client)
+        done.addCallback(check_batches)
+        return done
+
+    def test_max_connections(self):
+        """Tests that only max_connections batches are sent at once."""
+        self.config.set('outgoing', 'batch_size', '1')
+        self.config.set('outgoing', 'max_connections', '2')
+
+        pending = []
+        def send_result():
+            """Returns a send that completes only when the test says so."""
+            pending.append(defer.Deferred())
+            return pending[-1]
+        recipients = ['%s@test.local' % (c,) for c in 'abcde']
+        sent, _ = self._deliver([b'Subject: subject', b'', b'body'],
+                recipients=recipients, send_result=send_result)
+
+        # Each finished send lets exactly one more batch start
+        self.assertEqual(2, len(sent))
+        for done in range(3):
+            pending[done].callback(None)
+            self.assertEqual(3 + done, len(sent))
+            self.assertEqual(2, len([d for d in pending if not d.called]))
+        for d in pending[3:]:
+            d.callback(None)
+        self.assertEqual(5, len(sent))
+
+    def test_body_unchanged(self):
+        """Tests that the message body is sent on byte for byte."""
+        body = [b'--XX', b'Content-Type: text/plain; charset=utf-8', b'',
+                b'h\xc3\xa9llo', b'', b'--XX--']
+        lines = [b'Subject: subject',
+                b'Content-Type: multipart/mixed; boundary=XX', b''] + body
+        sent, _ = self._deliver(lines)
+
+        self.assertEqual(1, len(sent))
+        headers, sent_body = sent[0].split(b'\n\n', 1)
+        self.assertIn(b'Subject: [Named] subject', headers.split(b'\n'))
+        self.assertEqual(b'\n'.join(body) + b'\n', sent_body)
+
+    def test_long_header_unchanged(self):
+        """Tests that headers longer than 78 columns are not refolded."""
+        to = b'To: ' + b', '.join(b'member%d@test.local' % (i,)
+                for i in range(10))
+        sent, _ = self._deliver([b'Subject: subject', to, b'', b'body'])
+
+        self.assertEqual(1, len(sent))
+        headers, _ = sent[0].split(b'\n\n', 1)
+        self.assertIn(to, headers.split(b'\n'))
+
+    def test_bad_batch_size(self):
+        """Tests that a batch size below 1 is rejected at startup."""
+        for size in ['0', '-1']:
+            self.config.set('outgoing', 'batch_size', size)
+            self.assertRaises(RuntimeError, SetSMTPFactory, self.config, None)
+
+    def test_bad_max_connections(self):
+        """Tests that a connection limit below 1 is rejected at startup."""
+        for limit in ['0', '-1']:
+            self.config.set('outgoing', 'max_connections', limit)
+            self.assertRaises(RuntimeError, SetSMTPFactory, self.config, None)
+
+    def test_no_recipients(self):
+        """Tests that a message to an empty list is not sent anywhere."""
+        sent, events = self._deliver([b'Subject: subject', b'', b'body'],
+                address=b'empty', recipients=())
+
+        self.assertEqual([], sent)
+        errors = [e for e in events if e['log_level'] == LogLevel.error]
+        self.assertEqual(1, len(errors))
+        self.assertEqual('No recipients for {address}', errors[0]['log_format'])
+        self.assertEqual('empty', errors[0]['address'])
+
+    def test_parse_cached(self):
+        """Tests that repeated addresses reuse the parsed recipient set."""
+        factory = SetSMTPFactory(self.config, None)
+        first = factory.parse('named')
+        second = factory.parse('named')
+        self.assertIs(first, second)
+        self.assertEqual(frozenset(['b@test.local', 'c@test.local']), first[1])
+
+    def test_parse_cache_rejections(self):
+        """Tests that rejections are cached without evicting valid addresses.
+        """
+        calls = []
+        def parse(address):
+            """Accepts addresses starting with 'ok' and counts calls."""
+            calls.append(address)
+            if not address.startswith('ok'):
+                raise SyntaxError('No such list or person: %s' % (address,))
+            return (address, set([address + '@test.local']))
+        cache = ParseCache(parse, maxsize=1, rejected_maxsize=1)
+
+        cache('ok')
+        for _ in range(2):
+            with helper.AssertFail(self, SyntaxError, 'No such list or person: bad'):
+                cache('bad')
+        self.assertEqual(['ok', 'bad'], calls)
+
+        # A flood of rejections evicts only other rejections
+        for address in ['bad1', 'bad2', 'bad3']:
+            self.assertRaises(SyntaxError, cache, address)
+        self.assertEqual(('ok', frozenset(['ok@test.local'])), cache('ok'))
+        self.assertRaises(SyntaxError, cache, 'bad')
+        self.assertEqual(['ok', 'bad', 'bad1', 'bad2', 'bad3', 'bad'], calls)
+
+    def test_rfc822date(self):
+        """Tests that the Received date is only reformatted once a second."""
+        delivery = self._server_proto().delivery
+        now = [1000000000.25]
+        self.patch(time, 'time', lambda: now[0])
+
+        first = delivery.rfc822date()
+        self.assertEqual(smtp.rfc822date(time.localtime(1000000000)), first)
+
+        # Reused within the same second
+        now[0] = 1000000000.75
+        self.assertIs(first, delivery.rfc822date())
+
+        # Recomputed once the second changes
+        now[0] = 1000000001.5
+        second = delivery.rfc822date()
+        self.assertEqual(smtp.rfc822date(time.localtime(1000000001)), second)
+        self.assertNotEqual(first, second)
+
+    def test_accept_from(self):
+        """Tests source IP filtering against the accept_from networks."""
+        self.config.set('incoming', 'accept_from', '127.0.0.0/24, 10.0.0.1')
+        delivery = self._server_proto().delivery
+        origin = 'sender@test.local'
+
+        for ip in [b'127.0.0.1', b'127.0.0.255', b'10.0.0.1']:
+            self.assertEqual(origin,
+                    delivery.validateFrom((b'me.test', ip), origin))
+        for ip in [b'128.0.0.1', b'10.0.0.2']:
+            self.assertRaises(smtp.SMTPBadSender,
+                    delivery.validateFrom, (b'me.test', ip), origin)
+
+    def test_accept_from_any(self):
+        """Tests that mail is accepted from any IP if accept_from is unset."""
+        self.config.remove_option('incoming', 'accept_from')
+        delivery = self._server_proto().delivery
+        origin = 'sender@test.local'
+
+        self.assertIsNone(delivery.settings.accept_from)
+        for ip in [b'127.0.0.1', b'128.0.0.1', b'::1']:
+            self.assertEqual(origin,
+                    delivery.validateFrom((b'me.test', ip), origin))
+
     def test_bad_source_ip(self):
         """Attempts connection from address outside the accept_from range.
 